@@ -0,0 +1,18 @@
+"""Compile kernels.py ahead of time into the gpx_kernels extension module.
+
+Run once with `python build_kernels.py`; map_gen.py picks up the resulting
+gpx_kernels shared library and falls back to JIT compilation without it.
+"""
+import os
+from numba.pycc import CC
+
+import kernels
+
+cc = CC('gpx_kernels')
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+
+cc.export('rdp', 'void(f8[::1], f8[::1], f8, b1[::1])')(kernels.rdp.py_func)
+
+if __name__ == "__main__":
+    cc.compile()
+    print(f"Built {cc.name} in {cc.output_dir}")
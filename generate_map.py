@@ -1,8 +1,9 @@
-import gpxpy
 import json
+import orjson
 import glob
 import os
 from dotenv import load_dotenv
+from gpx_reader import read_gpx_points
 
 # Load environment variables from .env file
 load_dotenv()
@@ -138,8 +139,8 @@ def load_all_styles(pattern):
     
     for style_file in sorted(style_files):
         try:
-            with open(style_file, 'r') as f:
-                style_data = json.load(f)
+            with open(style_file, 'rb') as f:
+                style_data = orjson.loads(f.read())
                 # Use filename without extension as key
                 style_name = os.path.splitext(os.path.basename(style_file))[0]
                 styles[style_name] = style_data
@@ -156,8 +157,8 @@ def load_all_styles(pattern):
 def load_map_style(filename):
     """Load map style from JSON file (legacy function for backward compatibility)"""
     try:
-        with open(filename, 'r') as f:
-            return json.load(f)
+        with open(filename, 'rb') as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         print(f"Warning: Could not find {filename}. Using default style.")
         return []
@@ -167,14 +168,8 @@ def load_map_style(filename):
 
 def parse_gpx_to_json(filename):
     try:
-        with open(filename, 'r') as gpx_file:
-            gpx = gpxpy.parse(gpx_file)
-        points = []
-        for track in gpx.tracks:
-            for segment in track.segments:
-                for point in segment.points:
-                    points.append({'lat': point.latitude, 'lng': point.longitude})
-        return points
+        coords, _ = read_gpx_points(filename)
+        return [{'lat': lat, 'lng': lng} for lat, lng in coords.tolist()]
     except FileNotFoundError:
         print(f"Error: Could not find file {filename}")
         return []
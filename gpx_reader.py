@@ -0,0 +1,53 @@
+"""Minimal GPX trackpoint reader shared by map_gen.py and generate_map.py.
+
+Only needs the standard library's expat parser and NumPy.
+"""
+import mmap
+from array import array
+from datetime import datetime
+from xml.parsers import expat
+import numpy as np
+
+def read_gpx_points(filename):
+    """Read trackpoints into an (N, 2) lat/lng array plus the first point time."""
+    coords = array('d')  # Interleaved lat, lng
+    time_parts = []
+    in_trkpt = in_time = False
+    start_time = None
+
+    # Tags arrive as "namespace-uri tag" (or just "tag" without a namespace)
+    def start_element(name, attrs):
+        nonlocal in_trkpt, in_time
+        tag = name.rpartition(' ')[2]
+        if tag == 'trkpt':
+            coords.append(float(attrs['lat']))
+            coords.append(float(attrs['lon']))
+            in_trkpt = True
+        elif tag == 'time' and in_trkpt and start_time is None:
+            in_time = True
+
+    def end_element(name):
+        nonlocal in_trkpt, in_time, start_time
+        tag = name.rpartition(' ')[2]
+        if tag == 'trkpt':
+            in_trkpt = False
+        elif tag == 'time' and in_time:
+            in_time = False
+            start_time = ''.join(time_parts).strip() or None
+
+    def character_data(data):
+        if in_time:
+            time_parts.append(data)
+
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    # Hand expat the page-cache mapping directly instead of reading into a bytes copy
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        parser.Parse(mm, True)
+
+    if start_time:
+        start_time = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
+    return np.frombuffer(coords, dtype=np.float64).reshape(-1, 2), start_time
@@ -0,0 +1,62 @@
+"""Numba kernel for map_gen.py.
+
+It is JIT-compiled on first use. build_kernels.py compiles the same
+function ahead of time into the gpx_kernels extension module.
+"""
+import numpy as np
+from numba import njit
+
+@njit(cache=True, fastmath=True)
+def rdp(x, y, eps, keep_mask):
+    """Iterative Douglas-Peucker over projected x/y metres; marks kept points."""
+    n = x.shape[0]
+    keep_mask[:] = False
+    if n == 0:
+        return
+    keep_mask[0] = True
+    keep_mask[n - 1] = True
+
+    # Pending (lo, hi) ranges; live ranges are disjoint so n slots suffice
+    stack = np.empty((n, 2), dtype=np.int64)
+    stack[0, 0] = 0
+    stack[0, 1] = n - 1
+    top = 1
+    while top > 0:
+        top -= 1
+        lo = stack[top, 0]
+        hi = stack[top, 1]
+        if hi - lo < 2:
+            continue
+
+        x0 = x[lo]
+        y0 = y[lo]
+        dx = x[hi] - x0
+        dy = y[hi] - y0
+        seg_sq = dx * dx + dy * dy
+
+        # Compare squared distances scaled by seg_sq to keep the loop branch-free
+        best = -1.0
+        best_i = lo
+        if seg_sq > 0.0:
+            for i in range(lo + 1, hi):
+                cross = dx * (y[i] - y0) - dy * (x[i] - x0)
+                d = cross * cross
+                if d > best:
+                    best = d
+                    best_i = i
+            limit = eps * eps * seg_sq
+        else:
+            for i in range(lo + 1, hi):
+                d = (x[i] - x0) ** 2 + (y[i] - y0) ** 2
+                if d > best:
+                    best = d
+                    best_i = i
+            limit = eps * eps
+
+        if best > limit:
+            keep_mask[best_i] = True
+            stack[top, 0] = lo
+            stack[top, 1] = best_i
+            stack[top + 1, 0] = best_i
+            stack[top + 1, 1] = hi
+            top += 2
@@ -1,13 +1,35 @@
-import gpxpy
-import json
 import glob
 import os
 import argparse
-from jinja2 import Environment, FileSystemLoader
+import asyncio
+import functools
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import orjson
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from dotenv import load_dotenv
+from gpx_reader import read_gpx_points
 
 # Load environment variables
 load_dotenv()
+API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
+
+EARTH_RADIUS_M = 6371000.0
+CACHE_DIR = '.cache'
+CACHE_VERSION = 3  # Bump whenever parse_gpx output changes
+JINJA_CACHE_DIR = '.jinja_cache'
+OUTPUT_BUFFER_SIZE = 4 << 20  # Fewer, larger write() calls for multi-MB pages
+LARGE_OUTPUT_BYTES = 8 << 20  # Outputs past this are dropped from the page cache
+
+# Compiled templates are cached on disk; auto_reload=False skips per-render stat checks
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+_ENV = Environment(
+    loader=FileSystemLoader('.'),
+    bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR, '%s.cache'),
+    auto_reload=False,
+)
 
 def load_styles(pattern):
     """Load JSON style files."""
@@ -16,122 +38,373 @@ def load_styles(pattern):
     
     for style_file in sorted(style_files):
         try:
-            with open(style_file, 'r') as f:
+            with open(style_file, 'rb') as f:
                 name = os.path.splitext(os.path.basename(style_file))[0]
-                styles[name] = json.load(f)
+                styles[name] = orjson.loads(f.read())
                 print(f"Loaded style: {name}")
         except Exception as e:
             print(f"Skipping {style_file}: {e}")
     
     return styles
 
+@functools.lru_cache(maxsize=None)
+def load_style_context(pattern):
+    """Load styles once per pattern, with the template values derived from them."""
+    styles = load_styles(pattern)
+    return {
+        'all_styles_json': script_json(styles),
+        'style_names': list(styles.keys()),
+        'default_style': next(iter(styles), 'default'),
+    }
+
+def simplify_coords(coords, max_distance):
+    """Douglas-Peucker simplify lat/lng coords with a tolerance in metres."""
+    if len(coords) < 3:
+        return coords
+
+    # Equirectangular projection around the centroid is plenty for a single route
+    lat0, lon0 = np.radians(coords.mean(axis=0))
+    lat, lon = np.radians(coords).T
+    x = np.ascontiguousarray((lon - lon0) * np.cos(lat0) * EARTH_RADIUS_M)
+    y = np.ascontiguousarray((lat - lat0) * EARTH_RADIUS_M)
+
+    # Imported here so runs served entirely from the cache never load Numba
+    try:
+        # Ahead-of-time build (python build_kernels.py) skips JIT warmup entirely
+        from gpx_kernels import rdp
+    except ImportError:
+        from kernels import rdp
+
+    keep_mask = np.empty(len(coords), dtype=np.bool_)
+    rdp(x, y, float(max_distance), keep_mask)
+    return coords[keep_mask]
+
+def haversine_length(coords):
+    """Total great-circle length in metres of an (N, 2) lat/lng array."""
+    if len(coords) < 2:
+        return 0.0
+    lat1, lon1 = np.radians(coords[:-1]).T
+    lat2, lon2 = np.radians(coords[1:]).T
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return float(2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a)).sum())
+
+def encode_polyline(coords):
+    """Google encoded-polyline string (1e-5 degree precision) for an (N, 2) lat/lng array."""
+    points = np.round(coords * 1e5).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    if not deltas.size:
+        return ''
+    # Zigzag the sign into the low bit, then split into 5-bit chunks low to high
+    values = deltas << 1
+    values = np.where(deltas < 0, ~values, values)
+    width = max(1, -(-int(values.max()).bit_length() // 5))
+    shifted = values[:, None] >> (5 * np.arange(width, dtype=np.int64))
+    lengths = 1 + np.count_nonzero(shifted[:, 1:], axis=1)
+    chars = (shifted & 0x1f) + 63
+    chars[np.arange(width) < (lengths - 1)[:, None]] += 0x20
+    return chars[np.arange(width) < lengths[:, None]].astype(np.uint8).tobytes().decode('ascii')
+
+def script_json(obj):
+    """Serialize obj with orjson for inlining in a <script> block."""
+    data = orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    # Same escaping as Jinja's tojson so the payload can't break out of the script tag
+    for char, escaped in ((b'<', b'\\u003c'), (b'>', b'\\u003e'), (b'&', b'\\u0026'), (b"'", b'\\u0027')):
+        data = data.replace(char, escaped)
+    return data.decode()
+
 def parse_gpx(filename):
     """Parse GPX and return coords + stats."""
     try:
-        with open(filename, 'r') as gpx_file:
-            gpx = gpxpy.parse(gpx_file)
-        
+        coords, start_time = read_gpx_points(filename)
+
         # Simplify the track to reduce HTML size (preserve topology)
         # This is CRITICAL for long runs
-        for track in gpx.tracks:
-            track.simplify(max_distance=10) # Max error 10 meters
-
-        points = []
-        for track in gpx.tracks:
-            for segment in track.segments:
-                for point in segment.points:
-                    points.append({'lat': point.latitude, 'lng': point.longitude})
-        
+        coords = simplify_coords(coords, max_distance=10) # Max error 10 meters
+
         # Calculate stats
-        total_dist = round(gpx.length_2d() / 1000, 2)
-        start_time = gpx.get_time_bounds().start_time
+        total_dist = round(haversine_length(coords) / 1000, 2)
         date_str = start_time.strftime("%Y-%m-%d %H:%M") if start_time else "N/A"
 
-        return points, total_dist, date_str
+        return coords, total_dist, date_str
     except Exception as e:
         print(f"Error parsing GPX: {e}")
-        return [], 0, ""
+        return np.empty((0, 2)), 0, ""
 
-def load_all_gpx_files(routes_dir):
-    """Load all GPX files from routes directory."""
-    gpx_files = glob.glob(os.path.join(routes_dir, '*.gpx'))
-    routes = {}
-    
-    for gpx_file in sorted(gpx_files):
+def load_gpx(filename, cache_dir=CACHE_DIR):
+    """parse_gpx with an on-disk cache keyed by (path, mtime, size).
+
+    Entries are named <path hash>-<key hash>.npz so that writing a new entry
+    can drop the stale ones for the same file.
+    """
+    try:
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+    except OSError:
+        return parse_gpx(filename)
+
+    path_key = hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+    key = hashlib.blake2b(f"{CACHE_VERSION}:{path}:{st.st_mtime_ns}:{st.st_size}".encode(), digest_size=16).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{path_key}-{key}.npz")
+    try:
+        with np.load(cache_path) as cached:
+            return cached['coords'], float(cached['distance']), str(cached['date'])
+    except Exception:
+        # Missing or corrupt (e.g. truncated) entry: re-parse and overwrite it
+        pass
+
+    coords, distance, date = parse_gpx(filename)
+    if len(coords):
         try:
-            coords, distance, date = parse_gpx(gpx_file)
-            if coords:
-                filename = os.path.basename(gpx_file)
-                routes[filename] = {
-                    'coords': coords,
-                    'distance': distance,
-                    'date': date
-                }
-                print(f"Loaded route: {filename}")
-        except Exception as e:
-            print(f"Skipping {gpx_file}: {e}")
-    
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write then rename so a concurrent reader never sees a partial file
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, coords=coords, distance=distance, date=date)
+            os.replace(tmp_path, cache_path)
+
+            # Drop entries left behind by earlier edits of this file or older CACHE_VERSIONs
+            for stale in glob.glob(os.path.join(cache_dir, f"{path_key}-*.npz")):
+                if stale != cache_path:
+                    os.remove(stale)
+        except OSError as e:
+            print(f"Could not cache {filename}: {e}")
+    return coords, distance, date
+
+def load_gpx_into(filename, shm_name):
+    """Pool worker: load_gpx, writing coords into the named shared memory block."""
+    coords, distance, date = load_gpx(filename)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        np.ndarray(coords.shape, dtype=np.float64, buffer=shm.buf)[:] = coords
+    finally:
+        shm.close()
+    return len(coords), distance, date
+
+def submit_gpx(executor, filename):
+    """Parse filename on the process pool; returns a future of (coords, distance, date).
+
+    Coordinates come back through a shared memory block owned by this process
+    rather than being pickled through the pool's result pipe.
+    """
+    # Simplified coords take 16 bytes per point, and every <trkpt> takes more
+    # than that in the GPX file, so the file size is an upper bound
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        size = 0
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 16))
+    try:
+        future = asyncio.wrap_future(executor.submit(load_gpx_into, filename, shm.name))
+    except BaseException:
+        # e.g. BrokenProcessPool: collect() will never run to release the block
+        shm.close()
+        shm.unlink()
+        raise
+
+    async def collect():
+        try:
+            count, distance, date = await future
+            coords = np.ndarray((count, 2), dtype=np.float64, buffer=shm.buf).copy()
+            return coords, distance, date
+        finally:
+            shm.close()
+            shm.unlink()
+
+    return asyncio.ensure_future(collect())
+
+async def load_all_gpx_files(routes_dir, executor, known=None):
+    """Load all GPX files from routes directory.
+
+    known maps absolute paths to (futures of) (coords, distance, date) results
+    that are already being parsed; those files are not parsed again.
+    """
+    known = known or {}
+    gpx_files = sorted(glob.glob(os.path.join(routes_dir, '*.gpx')))
+
+    # Files are independent and CPU-bound, so parse them in worker processes.
+    # A failed submit becomes that file's result, so futures already submitted
+    # are still awaited below and release their shared memory
+    loop = asyncio.get_running_loop()
+    pending = []
+    for gpx_file in gpx_files:
+        future = known.get(os.path.abspath(gpx_file))
+        if future is None:
+            try:
+                future = submit_gpx(executor, gpx_file)
+            except Exception as e:
+                future = loop.create_future()
+                future.set_exception(e)
+        pending.append(future)
+    results = await asyncio.gather(*pending, return_exceptions=True)
+
+    # Collect in sorted order so the route list stays deterministic
+    routes = {}
+    for gpx_file, result in zip(gpx_files, results):
+        if isinstance(result, Exception):
+            print(f"Skipping {gpx_file}: {result}")
+            continue
+        coords, distance, date = result
+        if len(coords):
+            filename = os.path.basename(gpx_file)
+            routes[filename] = {
+                'coords': coords,
+                'distance': distance,
+                'date': date
+            }
+            print(f"Loaded route: {filename}")
+
     return routes
 
-def generate_map(gpx_path, output_path, style_pattern, template_file, routes_dir='routes'):
-    api_key = os.getenv('GOOGLE_MAPS_API_KEY')
-    if not api_key:
-        raise ValueError("Missing GOOGLE_MAPS_API_KEY in .env")
+def release_page_cache(f):
+    """Flush f and, if it is large, start writeback and drop it from the page cache."""
+    f.flush()
+    if hasattr(os, 'posix_fadvise') and f.tell() > LARGE_OUTPUT_BYTES:
+        # We won't read the output back, so don't let it evict hotter pages
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
 
-    # 1. Get Data for primary GPX file
-    print("Processing primary GPX...")
-    coords, distance, date = parse_gpx(gpx_path)
-    if not coords:
-        return
+def write_routes_script(routes, script_path):
+    """Write route polylines to a sidecar script the map loads on demand."""
+    polylines = {name: encode_polyline(route['coords']) for name, route in routes.items()}
+    with open(script_path, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f:
+        f.write(f"window.ROUTE_POLYLINES = {script_json(polylines)};\n".encode())
+        release_page_cache(f)
 
-    # 2. Load all GPX files for selector
-    print("Loading all routes...")
-    all_routes = load_all_gpx_files(routes_dir)
-    
-    # Add primary route if not already in all_routes
-    primary_filename = os.path.basename(gpx_path)
-    if primary_filename not in all_routes:
-        all_routes[primary_filename] = {
-            'coords': coords,
-            'distance': distance,
-            'date': date
-        }
-
-    # 3. Get Styles
-    print("Loading Styles...")
-    styles = load_styles(style_pattern)
-    default_style = list(styles.keys())[0] if styles else 'default'
-
-    # 4. Setup Jinja2 Environment
-    env = Environment(loader=FileSystemLoader('.'))
-    template = env.get_template(template_file)
-
-    # 5. Render HTML
+def write_map_html(template, style_context, all_routes, primary_filename, output_path, routes_script):
+    """Render the map page for one primary route straight to output_path."""
+    route = all_routes[primary_filename]
+    routes_manifest = {
+        name: {'distance': r['distance'], 'date': r['date']}
+        for name, r in all_routes.items()
+    }
+
+    # Render HTML as a stream; the route is embedded as an encoded polyline and the
+    # other payloads are pre-serialized with orjson
     print("Rendering HTML...")
-    html_output = template.render(
-        api_key=api_key,
-        route_coords=coords,
-        all_styles=styles,
-        style_names=list(styles.keys()),
-        default_style=default_style,
-        total_distance_km=distance,
-        start_time=date,
-        all_routes=all_routes,
+    stream = template.stream(
+        api_key=API_KEY,
+        route_polyline_json=script_json(encode_polyline(route['coords'])),
+        **style_context,
+        total_distance_km=route['distance'],
+        start_time=route['date'],
+        all_routes=routes_manifest,
+        all_routes_json=script_json(routes_manifest),
+        routes_script=os.path.relpath(routes_script, os.path.dirname(output_path) or '.'),
         default_route=primary_filename
     )
 
-    # 6. Save
-    with open(output_path, 'w') as f:
-        f.write(html_output)
+    # Save chunks as they render instead of building the whole page in memory
+    with open(output_path, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f:
+        stream.dump(f, encoding='utf-8')
+        release_page_cache(f)
+
+async def generate_map_async(gpx_path, output_path, style_pattern, template_file, routes_dir='routes', routes_script=None):
+    if not API_KEY:
+        raise ValueError("Missing GOOGLE_MAPS_API_KEY in .env")
+
+    workers = min(len(glob.glob(os.path.join(routes_dir, '*.gpx'))) + 1, os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # 1. Start parsing the primary GPX; the first submit forks the workers,
+        #    so do it before any helper threads exist
+        print("Processing primary GPX...")
+        primary = submit_gpx(executor, gpx_path)
+
+        # 2. Load all GPX files for selector, reusing the primary parse if it lives there
+        print("Loading all routes...")
+        routes_task = asyncio.create_task(
+            load_all_gpx_files(routes_dir, executor, known={os.path.abspath(gpx_path): primary})
+        )
+
+        # Styles and the template are small file reads (and cached after the first
+        # map); load them on threads so they finish underneath the CPU-bound GPX parsing
+        print("Loading Styles...")
+        styles_task = asyncio.create_task(asyncio.to_thread(load_style_context, style_pattern))
+        template_task = asyncio.create_task(asyncio.to_thread(_ENV.get_template, template_file))
+
+        coords, distance, date = await primary
+        if not len(coords):
+            await asyncio.gather(routes_task, styles_task, template_task, return_exceptions=True)
+            return
+        all_routes = await routes_task
+
+    # Add the primary route; it replaces any routes-dir file with the same basename
+    primary_filename = os.path.basename(gpx_path)
+    all_routes[primary_filename] = {
+        'coords': coords,
+        'distance': distance,
+        'date': date
+    }
+
+    # 3. Collect styles and template (compiled bytecode is reused across runs)
+    style_context, template = await asyncio.gather(styles_task, template_task)
+
+    # 4. Write every route's coordinates to a sidecar script next to the HTML
+    #    while the page renders; the page only inlines the primary route and route metadata
+    if routes_script is None:
+        routes_script = os.path.splitext(output_path)[0] + '_routes.js'
+    sidecar_task = asyncio.create_task(asyncio.to_thread(write_routes_script, all_routes, routes_script))
+
+    # 5. Render and save the page
+    write_map_html(template, style_context, all_routes, primary_filename, output_path, routes_script)
+    await sidecar_task
     print(f"Done! Map saved to {output_path}")
 
+def generate_map(gpx_path, output_path, style_pattern, template_file, routes_dir='routes', routes_script=None):
+    """Synchronous entry point; see generate_map_async."""
+    asyncio.run(generate_map_async(gpx_path, output_path, style_pattern, template_file, routes_dir, routes_script))
+
+async def generate_batch_async(routes_dir, output_dir, style_pattern, template_file):
+    """Generate one map per GPX file in routes_dir, sharing all setup between them."""
+    if not API_KEY:
+        raise ValueError("Missing GOOGLE_MAPS_API_KEY in .env")
+
+    workers = min(len(glob.glob(os.path.join(routes_dir, '*.gpx'))), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        # Every route is parsed exactly once; the routes task is scheduled first,
+        # so its submits fork the workers before the helper threads below start
+        print("Loading all routes...")
+        routes_task = asyncio.create_task(load_all_gpx_files(routes_dir, executor))
+        print("Loading Styles...")
+        styles_task = asyncio.create_task(asyncio.to_thread(load_style_context, style_pattern))
+        template_task = asyncio.create_task(asyncio.to_thread(_ENV.get_template, template_file))
+        all_routes = await routes_task
+    style_context, template = await asyncio.gather(styles_task, template_task)
+
+    if not all_routes:
+        print(f"No routes loaded from '{routes_dir}'.")
+        return
+
+    # All maps show the same routes, so they share a single sidecar script
+    os.makedirs(output_dir, exist_ok=True)
+    routes_script = os.path.join(output_dir, 'routes.js')
+    write_routes_script(all_routes, routes_script)
+
+    for filename in all_routes:
+        output_path = os.path.join(output_dir, os.path.splitext(filename)[0] + '.html')
+        write_map_html(template, style_context, all_routes, filename, output_path, routes_script)
+        print(f"Done! Map saved to {output_path}")
+
+def generate_batch(routes_dir, output_dir, style_pattern, template_file):
+    """Synchronous entry point; see generate_batch_async."""
+    asyncio.run(generate_batch_async(routes_dir, output_dir, style_pattern, template_file))
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate Marathon Map")
     parser.add_argument('gpx_file', nargs='?', help="Path to input GPX file (optional, defaults to first file in routes folder)")
     parser.add_argument('--output', default='marathon_map.html', help="Output HTML file")
     parser.add_argument('--routes-dir', default='routes', help="Directory containing GPX files (default: routes)")
+    parser.add_argument('--batch', action='store_true', help="Generate one map per GPX file in the routes directory")
+    parser.add_argument('--output-dir', default='maps', help="Output directory for --batch (default: maps)")
     
     args = parser.parse_args()
+
+    if args.batch:
+        generate_batch(
+            routes_dir=args.routes_dir,
+            output_dir=args.output_dir,
+            style_pattern='styles/*.json',
+            template_file='template.html'
+        )
+        exit(0)
     
     # If no GPX file provided, find one from routes directory
     if not args.gpx_file: